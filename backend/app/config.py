@@ -4,6 +4,7 @@ Configuration management for Smart Study Assistant
 
 import os
 from pathlib import Path
+from typing import Literal
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -24,6 +25,7 @@ class Settings(BaseSettings):
     # Paths
     upload_dir: Path = DATA_DIR / "uploads"
     chroma_dir: Path = DATA_DIR / "chroma"
+    index_dir: Path = DATA_DIR / "index"
     history_dir: Path = DATA_DIR / "history"
     
     # Chunking settings
@@ -33,8 +35,31 @@ class Settings(BaseSettings):
     # RAG settings
     top_k_results: int = 5
     
+    # Answer cache settings
+    answer_cache_size: int = 512
+    # Cosine similarity above which a past question's answer is reused
+    semantic_cache_threshold: float = 0.97
+    
+    # Vector index settings
+    # "flat" is exact brute-force search, fastest for small corpora (< ~50k chunks);
+    # "ivfpq" compresses vectors with product quantization for very large corpora
+    vector_index_type: Literal["flat", "hnsw", "ivfpq"] = "hnsw"
+    # Precision of vectors stored by flat and HNSW indexes (fp16 halves memory and disk)
+    vector_dtype: Literal["fp32", "fp16"] = "fp16"
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    ivf_nlist: int = 256
+    ivf_nprobe: int = 16
+    pq_m: int = 16
+    
     # Model settings
     embedding_model: str = "all-MiniLM-L6-v2"
+    # fp16 applies on CUDA only; int8 uses dynamic quantization on CPU
+    embedding_dtype: Literal["fp32", "fp16", "int8"] = "fp32"
+    # "onnx" serves the model exported by scripts/export_onnx.py with onnxruntime
+    embedding_backend: Literal["torch", "onnx"] = "torch"
+    onnx_model_dir: Path = DATA_DIR / "onnx" / "minilm"
     chat_model: str = "gemini-1.5-flash"
     
     class Config:
@@ -48,4 +73,5 @@ settings = Settings()
 # Ensure directories exist
 settings.upload_dir.mkdir(parents=True, exist_ok=True)
 settings.chroma_dir.mkdir(parents=True, exist_ok=True)
+settings.index_dir.mkdir(parents=True, exist_ok=True)
 settings.history_dir.mkdir(parents=True, exist_ok=True)
@@ -3,12 +3,16 @@ Semantic Document Search - FastAPI Backend
 A simple AI-powered document search application.
 """
 
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from app.routers import documents, search
 from app.services.vector_store import vector_store
+from app.services.embedding_service import embedding_service
+from app.services.document_service import document_service
 
 
 @asynccontextmanager
@@ -16,7 +20,14 @@ async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
     print("🚀 Starting Semantic Document Search Backend...")
     print(f"📊 Vector store has {vector_store.get_document_count()} chunks indexed")
+    # Load and exercise the embedding model in the background so the first request doesn't pay for it.
+    # warmup logs its own failures; keep a reference so the task isn't garbage collected
+    warmup = asyncio.create_task(asyncio.to_thread(embedding_service.warmup))
     yield
+    # A running thread can't be cancelled, so let it finish before closing the services
+    await warmup
+    document_service.flush()
+    document_service.close()
     print("👋 Shutting down...")
 
 
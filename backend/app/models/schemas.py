@@ -21,6 +21,7 @@ class DocumentUploadResponse(BaseModel):
     filename: str
     chunk_count: int
     message: str
+    deduplicated: bool = False
 
 
 class DocumentInfo(BaseModel):
@@ -3,8 +3,11 @@ Chat Router - API endpoints for chat and RAG queries
 """
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import List
 
+import orjson
+
 from app.models.schemas import ChatRequest, ChatResponse, ConversationHistory, Message
 from app.services.rag_service import rag_service
 
@@ -23,7 +26,7 @@ async def chat(request: ChatRequest):
     - quiz: Generate quiz questions from documents
     """
     try:
-        result = rag_service.query(
+        result = await rag_service.query(
             question=request.question,
             mode=request.mode,
             conversation_id=request.conversation_id
@@ -45,6 +48,26 @@ async def chat(request: ChatRequest):
         )
 
 
+@router.post("/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Send a message and stream the response as newline-delimited JSON
+    
+    Events: "meta" (conversation_id, mode, sources), then "token" chunks
+    of the answer, then "done" or "error".
+    """
+    events = rag_service.query_stream(
+        question=request.question,
+        mode=request.mode,
+        conversation_id=request.conversation_id
+    )
+    
+    return StreamingResponse(
+        (orjson.dumps(event) + b"\n" async for event in events),
+        media_type="application/x-ndjson"
+    )
+
+
 @router.get("/history/{conversation_id}", response_model=ConversationHistory)
 async def get_history(conversation_id: str):
     """Get conversation history by ID"""
@@ -2,6 +2,8 @@
 Documents Router - API endpoints for document management
 """
 
+import asyncio
+
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from typing import List
 
@@ -13,6 +15,9 @@ from app.services.vector_store import vector_store
 
 router = APIRouter()
 
+# Caps how many uploads run the embedding model at once
+embedding_semaphore = asyncio.Semaphore(2)
+
 
 @router.post("/upload", response_model=DocumentUploadResponse)
 async def upload_document(file: UploadFile = File(...)):
@@ -34,14 +39,22 @@ async def upload_document(file: UploadFile = File(...)):
         )
     
     try:
-        # Read file content
-        content = await file.read()
+        # Stream file to storage
+        doc_id, deduplicated = await document_service.save_stream(file.filename, file)
         
-        # Save file
-        doc_id = document_service.save_file(file.filename, content)
+        # Identical content is already indexed - skip extraction and embedding
+        if deduplicated:
+            existing = document_service.get_document(doc_id)
+            return DocumentUploadResponse(
+                id=doc_id,
+                filename=existing["filename"],
+                chunk_count=existing["chunk_count"],
+                message=f"Document already indexed as {existing['filename']}",
+                deduplicated=True
+            )
         
-        # Extract text
-        text = document_service.extract_text(doc_id)
+        # Extract text (CPU-bound stages run in worker threads to keep the event loop free)
+        text = await asyncio.to_thread(document_service.extract_text, doc_id)
         
         if not text.strip():
             raise HTTPException(
@@ -50,10 +63,11 @@ async def upload_document(file: UploadFile = File(...)):
             )
         
         # Chunk text
-        chunks = chunking_service.split_text(text, doc_id, file.filename)
+        texts, base_meta = await asyncio.to_thread(chunking_service.split_text, text, doc_id, file.filename)
         
         # Add to vector store
-        chunk_count = vector_store.add_documents(chunks, doc_id)
+        async with embedding_semaphore:
+            chunk_count = await asyncio.to_thread(vector_store.add_documents, texts, base_meta)
         
         # Update metadata
         document_service.update_chunk_count(doc_id, chunk_count)
@@ -109,8 +123,8 @@ async def get_document(doc_id: str):
 @router.delete("/{doc_id}")
 async def delete_document(doc_id: str):
     """Delete a document and its vectors"""
-    # Delete from vector store
-    vector_store.delete_document(doc_id)
+    # Delete from vector store (waits for the store lock, so keep it off the event loop)
+    await asyncio.to_thread(vector_store.delete_document, doc_id)
     
     # Delete file and metadata
     deleted = document_service.delete_document(doc_id)
@@ -2,6 +2,8 @@
 Search Router - Semantic search endpoints
 """
 
+import asyncio
+
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
@@ -34,6 +36,36 @@ class SearchResponse(BaseModel):
     total_results: int
 
 
+class BatchSearchQuery(BaseModel):
+    """Several search queries answered in one call"""
+    queries: List[str]
+    top_k: Optional[int] = 5
+
+
+class BatchSearchResponse(BaseModel):
+    """One search response per query, in query order"""
+    responses: List[SearchResponse]
+
+
+def _format_response(query: str, results: List[dict]) -> SearchResponse:
+    """Build the API response for one query's vector store results"""
+    search_results = [
+        SearchResult(
+            content=r["content"],
+            filename=r["metadata"].get("filename", "Unknown"),
+            similarity_score=round(r["relevance_score"], 4),
+            chunk_index=r["metadata"].get("chunk_index", 0)
+        )
+        for r in results
+    ]
+    
+    return SearchResponse(
+        query=query,
+        results=search_results,
+        total_results=len(search_results)
+    )
+
+
 @router.post("", response_model=SearchResponse)
 async def search_documents(request: SearchQuery):
     """
@@ -45,24 +77,37 @@ async def search_documents(request: SearchQuery):
         raise HTTPException(status_code=400, detail="Query cannot be empty")
     
     try:
-        # Search in vector store
-        results = vector_store.search(request.query, n_results=request.top_k)
+        # Search in vector store (in a worker thread: embedding and the store lock can block)
+        results = await asyncio.to_thread(vector_store.search, request.query, n_results=request.top_k)
+        
+        return _format_response(request.query, results)
         
-        # Format results
-        search_results = [
-            SearchResult(
-                content=r["content"],
-                filename=r["metadata"].get("filename", "Unknown"),
-                similarity_score=round(r["relevance_score"], 4),
-                chunk_index=r["metadata"].get("chunk_index", 0)
-            )
-            for r in results
-        ]
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Search error: {str(e)}"
+        )
+
+
+@router.post("/batch", response_model=BatchSearchResponse)
+async def search_documents_batch(request: BatchSearchQuery):
+    """
+    Search documents for several queries at once.
+    
+    All queries are embedded together and answered with a single index
+    search, which is cheaper than one request per query.
+    """
+    if not request.queries or any(not q.strip() for q in request.queries):
+        raise HTTPException(status_code=400, detail="Queries cannot be empty")
+    
+    try:
+        batch_results = await asyncio.to_thread(vector_store.search_batch, request.queries, n_results=request.top_k)
         
-        return SearchResponse(
-            query=request.query,
-            results=search_results,
-            total_results=len(search_results)
+        return BatchSearchResponse(
+            responses=[
+                _format_response(query, results)
+                for query, results in zip(request.queries, batch_results)
+            ]
         )
         
     except Exception as e:
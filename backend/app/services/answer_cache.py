@@ -0,0 +1,152 @@
+"""
+Answer Cache - Exact and semantic cache of RAG answers
+"""
+
+import atexit
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+from app.config import settings
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+
+logger = logging.getLogger(__name__)
+
+# (answer, sources as plain dicts)
+CachedAnswer = Tuple[str, List[dict]]
+
+
+class AnswerCache:
+    """
+    Two-tier cache of generated answers
+    
+    Exact hits are looked up by (question, mode) in an LRU. Otherwise the
+    question embedding is compared with every past question (with simsimd's
+    SIMD kernels when installed), and an answer in the same mode is reused
+    when the cosine similarity exceeds the threshold.
+    """
+    
+    def __init__(self, path: Path = None):
+        self.path = path or settings.history_dir / "_semcache.npz"
+        self.max_size = settings.answer_cache_size
+        self.threshold = settings.semantic_cache_threshold
+        self._lock = threading.Lock()
+        
+        self._exact: "OrderedDict[Tuple[str, str], CachedAnswer]" = OrderedDict()
+        # Past question embeddings, row i belongs to entries[i]
+        self.vectors: Optional[np.ndarray] = None
+        self.entries: List[dict] = []
+        # Identifies the model and corpus the answers were generated from
+        self.revision: Optional[list] = None
+        
+        self._load()
+    
+    def _load(self):
+        """Load the semantic tier saved by a previous run"""
+        if not self.path.exists():
+            return
+        
+        try:
+            with np.load(self.path) as data:
+                vectors = data["vectors"]
+                meta = orjson.loads(data["meta"].tobytes())
+        except Exception as e:
+            logger.warning(f"Could not read answer cache: {e}")
+            return
+        
+        if len(vectors):
+            self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.entries = meta["entries"]
+        self.revision = meta["revision"]
+    
+    def save(self):
+        """Write the semantic tier to disk atomically"""
+        with self._lock:
+            if self.vectors is None:
+                return
+            
+            meta = orjson.dumps({"revision": self.revision, "entries": self.entries})
+            
+            tmp = self.path.with_suffix(".tmp.npz")
+            np.savez(tmp, vectors=self.vectors, meta=np.frombuffer(meta, dtype=np.uint8))
+            os.replace(tmp, self.path)
+    
+    def sync(self, revision: tuple):
+        """Drop every cached answer if the model or the indexed documents changed"""
+        revision = list(revision)
+        with self._lock:
+            if revision != self.revision:
+                self._exact.clear()
+                self.vectors = None
+                self.entries = []
+                self.revision = revision
+    
+    def get(self, question: str, mode: str) -> Optional[CachedAnswer]:
+        """Exact lookup by question text and mode"""
+        key = (question.strip(), mode)
+        with self._lock:
+            hit = self._exact.get(key)
+            if hit is not None:
+                self._exact.move_to_end(key)
+        return hit
+    
+    def get_similar(self, vector: np.ndarray, mode: str) -> Optional[CachedAnswer]:
+        """Answer of the most similar past question in the same mode, if close enough"""
+        query = np.ascontiguousarray(vector, dtype=np.float32).reshape(1, -1)
+        
+        with self._lock:
+            if self.vectors is None:
+                return None
+            
+            if simsimd is not None:
+                scores = 1 - np.asarray(simsimd.cdist(query, self.vectors, metric="cosine"))[0]
+            else:
+                scores = (self.vectors @ query[0]) / max(np.linalg.norm(query), 1e-12)
+            
+            # Best match in the same mode, in case the nearest question was asked in another
+            close = np.flatnonzero(scores >= self.threshold)
+            for id_ in close[np.argsort(-scores[close])]:
+                entry = self.entries[id_]
+                if entry["mode"] == mode:
+                    return entry["answer"], entry["sources"]
+        
+        return None
+    
+    def put(self, question: str, mode: str, vector: np.ndarray, answer: str, sources: List[dict]):
+        """Store a freshly generated answer in both tiers"""
+        vector = np.array(vector, dtype=np.float32).reshape(1, -1)
+        vector /= max(np.linalg.norm(vector), 1e-12)
+        
+        with self._lock:
+            self._exact[(question.strip(), mode)] = (answer, sources)
+            if len(self._exact) > self.max_size:
+                self._exact.popitem(last=False)
+            
+            if self.vectors is None:
+                self.vectors = vector
+            else:
+                if len(self.vectors) >= self.max_size:
+                    # Evict the oldest quarter
+                    drop = self.max_size // 4
+                    self.vectors = self.vectors[drop:]
+                    self.entries = self.entries[drop:]
+                self.vectors = np.concatenate([self.vectors, vector])
+            
+            self.entries.append({"mode": mode, "answer": answer, "sources": sources})
+
+
+# Singleton instance
+answer_cache = AnswerCache()
+# Persist the semantic tier when the process exits
+atexit.register(answer_cache.save)
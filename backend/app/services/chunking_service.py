@@ -2,8 +2,10 @@
 Chunking Service - Intelligent text splitting for RAG
 """
 
-from typing import List
-import re
+from bisect import bisect_right
+from itertools import accumulate, repeat
+from operator import add
+from typing import List, Tuple
 
 from app.config import settings
 
@@ -18,44 +20,59 @@ class ChunkingService:
     
     def _split_text_recursive(self, text: str, separators: List[str]) -> List[str]:
         """Recursively split text using different separators"""
+        spans = self._split_spans(text, 0, len(text), separators)
+        return [chunk for chunk in (text[s:e].strip() for s, e in spans) if chunk]
+    
+    def _split_spans(self, text: str, start: int, end: int, separators: List[str]) -> List[Tuple[int, int]]:
+        """
+        Split text[start:end] into (start, end) chunk spans
+        
+        Chunks are tracked as offsets into the original string and only
+        sliced out once, after packing.
+        """
         if not separators:
-            return [text] if text else []
+            return [(start, end)] if end > start else []
         
         separator = separators[0]
         remaining_separators = separators[1:]
         
-        # Split by current separator
-        if separator:
-            parts = text.split(separator)
-        else:
+        if not separator:
             # Character-level split as last resort
-            parts = list(text)
+            return [(s, min(s + self.chunk_size, end)) for s in range(start, end, self.chunk_size)]
         
-        chunks = []
-        current_chunk = ""
+        # Piece boundaries: each piece runs up to and including the next
+        # separator. Computed with C-level split/accumulate so the packing
+        # loop below only iterates once per chunk, not once per piece.
+        sep_len = len(separator)
+        pieces = text[start:end].split(separator)
+        bounds = list(accumulate(map(add, map(len, pieces), repeat(sep_len)), initial=start))
+        bounds[-1] -= sep_len  # the last piece has no trailing separator
+        last = len(bounds) - 1
         
-        for part in parts:
-            # Add separator back except for last item
-            part_with_sep = part + separator if separator else part
-            
-            if len(current_chunk) + len(part_with_sep) <= self.chunk_size:
-                current_chunk += part_with_sep
+        spans = []
+        chunk_start = start
+        k = 0  # bounds[k] == chunk_start
+        
+        while k < last:
+            # Greedily take as many whole pieces as fit in one chunk
+            j = bisect_right(bounds, chunk_start + self.chunk_size, k) - 1
+            if j > k:
+                if bounds[j] > chunk_start:
+                    spans.append((chunk_start, bounds[j]))
             else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                
-                # If part itself is too large, recursively split it
-                if len(part_with_sep) > self.chunk_size and remaining_separators:
-                    sub_chunks = self._split_text_recursive(part, remaining_separators)
-                    chunks.extend(sub_chunks)
-                    current_chunk = ""
+                # The next piece alone is too large
+                piece_end = bounds[k + 1]
+                part_end = piece_end - sep_len if k + 1 < last else piece_end
+                if remaining_separators:
+                    spans.extend(self._split_spans(text, chunk_start, part_end, remaining_separators))
                 else:
-                    current_chunk = part_with_sep
-        
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
+                    spans.append((chunk_start, piece_end))
+                j = k + 1
+            
+            chunk_start = bounds[j]
+            k = j
         
-        return chunks
+        return spans
     
     def _create_overlapping_chunks(self, chunks: List[str]) -> List[str]:
         """Add overlap between chunks for context continuity"""
@@ -75,37 +92,30 @@ class ChunkingService:
         
         return overlapping_chunks
     
-    def split_text(self, text: str, doc_id: str, filename: str) -> List[dict]:
+    def split_text(self, text: str, doc_id: str, filename: str) -> Tuple[List[str], dict]:
         """
-        Split text into chunks with metadata
+        Split text into chunks
         
-        Returns list of dicts with 'content' and 'metadata' keys
+        Returns (contents, base_meta): the non-empty chunk texts and the
+        metadata shared by every chunk. A chunk's index is its position
+        in contents.
         """
-        # Clean the text
-        text = re.sub(r'\s+', ' ', text).strip()
+        # Collapse whitespace (str.split is ~5x faster than an equivalent re.sub)
+        text = " ".join(text.split())
         
         # Split the text recursively
         raw_chunks = self._split_text_recursive(text, self.separators)
         
         # Add overlap
-        chunks = self._create_overlapping_chunks(raw_chunks)
+        contents = [chunk for chunk in self._create_overlapping_chunks(raw_chunks) if chunk.strip()]
         
-        # Add metadata to each chunk
-        result = []
-        for i, chunk in enumerate(chunks):
-            if chunk.strip():  # Only add non-empty chunks
-                result.append({
-                    "content": chunk,
-                    "metadata": {
-                        "doc_id": doc_id,
-                        "filename": filename,
-                        "chunk_index": i,
-                        "total_chunks": len(chunks)
-                    }
-                })
+        base_meta = {
+            "doc_id": doc_id,
+            "filename": filename,
+            "total_chunks": len(contents)
+        }
         
-        return result
-
+        return contents, base_meta
 
 # Singleton instance
 chunking_service = ChunkingService()
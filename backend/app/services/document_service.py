@@ -3,14 +3,38 @@ Document Service - Handles PDF and TXT file processing
 """
 
 import fitz  # PyMuPDF
+import hashlib
+import io
+import logging
+import multiprocessing
 import os
 import uuid
-import json
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from datetime import datetime
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Iterator
+
+import orjson
+from fastapi import UploadFile
 
 from app.config import settings
+from app.services.pdf_worker import extract_page_range
+
+
+logger = logging.getLogger(__name__)
+
+# Read uploads 1 MiB at a time so memory use doesn't grow with file size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Encodings tried in order when decoding TXT files
+TXT_ENCODINGS = ["utf-8", "utf-16", "latin-1", "cp1252"]
+
+# PDFs with more pages than this are extracted by a pool of worker processes
+PARALLEL_PDF_MIN_PAGES = 32
+MAX_PDF_WORKERS = 8
 
 
 class DocumentService:
@@ -18,55 +42,122 @@ class DocumentService:
     
     def __init__(self):
         self.upload_dir = settings.upload_dir
-        self.metadata_file = self.upload_dir / "metadata.json"
-        self._load_metadata()
-    
-    def _load_metadata(self):
-        """Load document metadata from file"""
-        if self.metadata_file.exists():
-            with open(self.metadata_file, "r", encoding="utf-8") as f:
-                self.metadata = json.load(f)
-        else:
-            self.metadata = {}
+        self.db_file = self.upload_dir / "metadata.db"
+        self._lock = threading.Lock()
+        # Started on the first large PDF and reused for later ones
+        self._pdf_pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                saved_as TEXT NOT NULL,
+                upload_date TEXT NOT NULL,
+                file_size INTEGER NOT NULL,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                sha256 TEXT
+            )
+            """
+        )
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(documents)")}
+        if "sha256" not in columns:
+            self.conn.execute("ALTER TABLE documents ADD COLUMN sha256 TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_sha256 ON documents (sha256)")
+        self.conn.commit()
+        self._migrate_json_metadata()
     
-    def _save_metadata(self):
-        """Save document metadata to file"""
-        with open(self.metadata_file, "w", encoding="utf-8") as f:
-            json.dump(self.metadata, f, indent=2, ensure_ascii=False)
+    def _migrate_json_metadata(self):
+        """One-time import of the legacy metadata.json file"""
+        json_file = self.upload_dir / "metadata.json"
+        if not json_file.exists():
+            return
+        
+        legacy = orjson.loads(json_file.read_bytes())
+        
+        with self._lock:
+            self.conn.executemany(
+                """
+                INSERT OR IGNORE INTO documents (id, filename, saved_as, upload_date, file_size, chunk_count)
+                VALUES (:id, :filename, :saved_as, :upload_date, :file_size, :chunk_count)
+                """,
+                list(legacy.values())
+            )
+            self.conn.commit()
+        
+        json_file.rename(json_file.with_suffix(".json.migrated"))
     
-    def save_file(self, filename: str, content: bytes) -> str:
-        """Save uploaded file and return document ID"""
+    def _new_document(self, filename: str) -> Tuple[str, str, Path]:
+        """Allocate a document ID and its storage path"""
         doc_id = str(uuid.uuid4())[:8]
         
         # Create safe filename
         safe_filename = f"{doc_id}_{filename}"
-        file_path = self.upload_dir / safe_filename
+        return doc_id, safe_filename, self.upload_dir / safe_filename
+    
+    def _insert_document(self, doc_id: str, filename: str, safe_filename: str, file_size: int, sha256: str):
+        """Store metadata for a newly saved file"""
+        with self._lock:
+            self.conn.execute(
+                """
+                INSERT INTO documents (id, filename, saved_as, upload_date, file_size, chunk_count, sha256)
+                VALUES (?, ?, ?, ?, ?, 0, ?)
+                """,
+                (doc_id, filename, safe_filename, datetime.now().isoformat(), file_size, sha256)
+            )
+            self.conn.commit()
+    
+    def find_by_hash(self, sha256: str) -> Optional[dict]:
+        """Find an already indexed document with the same content hash"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM documents WHERE sha256 = ? AND chunk_count > 0 LIMIT 1", (sha256,)
+            ).fetchone()
+        return dict(row) if row else None
+    
+    async def save_stream(self, filename: str, upload: UploadFile) -> Tuple[str, bool]:
+        """
+        Stream an upload to disk in fixed-size chunks
+        
+        Returns (doc_id, deduplicated). If a document with identical content
+        is already indexed, the new copy is discarded and the existing ID is
+        returned with deduplicated=True.
+        """
+        doc_id, safe_filename, file_path = self._new_document(filename)
+        
+        size = 0
+        digest = hashlib.sha256()
+        with open(file_path, "wb") as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                out.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
         
-        # Save file
-        with open(file_path, "wb") as f:
-            f.write(content)
+        sha256 = digest.hexdigest()
+        existing = self.find_by_hash(sha256)
+        if existing:
+            os.remove(file_path)
+            return existing["id"], True
         
-        # Store metadata
-        self.metadata[doc_id] = {
-            "id": doc_id,
-            "filename": filename,
-            "saved_as": safe_filename,
-            "upload_date": datetime.now().isoformat(),
-            "file_size": len(content),
-            "chunk_count": 0
-        }
-        self._save_metadata()
+        self._insert_document(doc_id, filename, safe_filename, size, sha256)
         
-        return doc_id
+        return doc_id, False
     
-    def extract_text(self, doc_id: str) -> str:
-        """Extract text from a document"""
-        if doc_id not in self.metadata:
+    def _resolve(self, doc_id: str) -> Tuple[Path, str]:
+        """Return the stored file path and lowercased filename for a document"""
+        doc_info = self.get_document(doc_id)
+        if doc_info is None:
             raise ValueError(f"Document {doc_id} not found")
         
-        doc_info = self.metadata[doc_id]
-        file_path = self.upload_dir / doc_info["saved_as"]
-        filename = doc_info["filename"].lower()
+        return self.upload_dir / doc_info["saved_as"], doc_info["filename"].lower()
+    
+    def extract_text(self, doc_id: str) -> str:
+        """Extract text from a document"""
+        file_path, filename = self._resolve(doc_id)
         
         if filename.endswith(".pdf"):
             return self._extract_pdf(file_path)
@@ -75,24 +166,103 @@ class DocumentService:
         else:
             raise ValueError(f"Unsupported file type: {filename}")
     
+    def _iter_pdf_pages(self, file_path: Path) -> Iterator[Tuple[int, str]]:
+        """Yield the text of each non-empty PDF page"""
+        with fitz.open(file_path) as doc:
+            for page_num in range(doc.page_count):
+                page_text = doc[page_num].get_textpage().extractText()
+                if page_text.strip():
+                    yield page_num + 1, page_text
+    
+    def _extract_pdf_parallel(self, file_path: Path, page_count: int) -> Iterator[Tuple[int, str]]:
+        """
+        Yield non-empty (page number, text) pairs, extracting page ranges in parallel
+        
+        PyMuPDF is not thread-safe, so each worker is a separate process
+        that opens its own handle on the file. If a worker dies (a crash on
+        a malformed PDF, the OOM killer) the pool is replaced and the
+        extraction retried once.
+        """
+        for attempt in range(2):
+            pool, workers = self._get_pdf_pool()
+            step = -(-page_count // workers)
+            starts = range(0, page_count, step)
+            
+            try:
+                # Collected before yielding so a retry never repeats pages
+                ranges = list(pool.map(
+                    extract_page_range,
+                    [str(file_path)] * len(starts),
+                    starts,
+                    [min(start + step, page_count) for start in starts]
+                ))
+                break
+            except BrokenProcessPool:
+                logger.warning(f"PDF worker pool broke while extracting {file_path.name}, restarting it")
+                self._discard_pdf_pool(pool)
+                if attempt:
+                    raise ValueError(f"Could not extract text from {file_path.name}: PDF worker crashed")
+        
+        for start, texts in zip(starts, ranges):
+            for offset, page_text in enumerate(texts):
+                if page_text.strip():
+                    yield start + offset + 1, page_text
+    
+    def _get_pdf_pool(self) -> Tuple[ProcessPoolExecutor, int]:
+        """
+        Return the shared extraction pool and its size, starting it on first use
+        
+        Workers are spawned rather than forked: forking a process that runs
+        torch and FAISS threads can deadlock, and spawn is what Windows uses
+        anyway. pdf_worker has no import side effects, so spawning is cheap.
+        """
+        workers = min(MAX_PDF_WORKERS, os.cpu_count() or 1)
+        
+        if self._pdf_pool is None:
+            with self._pool_lock:
+                if self._pdf_pool is None:
+                    self._pdf_pool = ProcessPoolExecutor(
+                        max_workers=workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._pdf_pool, workers
+    
+    def _discard_pdf_pool(self, pool: ProcessPoolExecutor):
+        """Shut down a broken pool so the next extraction starts a fresh one"""
+        with self._pool_lock:
+            # Another thread may already have replaced it
+            if self._pdf_pool is pool:
+                self._pdf_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _join_pages(self, pages: Iterator[Tuple[int, str]]) -> str:
+        """Concatenate page texts with [Page N] markers into a single string"""
+        buf = io.StringIO()
+        
+        for page_num, page_text in pages:
+            if buf.tell():
+                buf.write("\n\n")
+            buf.write(f"[Page {page_num}]\n")
+            buf.write(page_text)
+        
+        return buf.getvalue()
+    
     def _extract_pdf(self, file_path: Path) -> str:
         """Extract text from PDF file"""
-        text_parts = []
-        
         with fitz.open(file_path) as doc:
-            for page_num, page in enumerate(doc, 1):
-                page_text = page.get_text()
-                if page_text.strip():
-                    text_parts.append(f"[Page {page_num}]\n{page_text}")
+            page_count = doc.page_count
         
-        return "\n\n".join(text_parts)
+        if page_count > PARALLEL_PDF_MIN_PAGES and (os.cpu_count() or 1) > 1:
+            pages = self._extract_pdf_parallel(file_path, page_count)
+        else:
+            pages = self._iter_pdf_pages(file_path)
+        
+        return self._join_pages(pages)
     
     def _extract_txt(self, file_path: Path) -> str:
         """Extract text from TXT file"""
         # Try different encodings
-        encodings = ["utf-8", "utf-16", "latin-1", "cp1252"]
-        
-        for encoding in encodings:
+        for encoding in TXT_ENCODINGS:
             try:
                 with open(file_path, "r", encoding=encoding) as f:
                     return f.read()
@@ -105,24 +275,39 @@ class DocumentService:
     
     def update_chunk_count(self, doc_id: str, count: int):
         """Update the chunk count for a document"""
-        if doc_id in self.metadata:
-            self.metadata[doc_id]["chunk_count"] = count
-            self._save_metadata()
+        with self._lock:
+            self.conn.execute("UPDATE documents SET chunk_count = ? WHERE id = ?", (count, doc_id))
+            self.conn.commit()
+    
+    def flush(self):
+        """Checkpoint the write-ahead log into the main database file"""
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
+    def close(self):
+        """Stop the PDF extraction workers"""
+        if self._pdf_pool is not None:
+            self._pdf_pool.shutdown(cancel_futures=True)
+            self._pdf_pool = None
     
     def get_document(self, doc_id: str) -> Optional[dict]:
         """Get document metadata"""
-        return self.metadata.get(doc_id)
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return dict(row) if row else None
     
     def list_documents(self) -> list:
         """List all documents"""
-        return list(self.metadata.values())
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM documents ORDER BY upload_date").fetchall()
+        return [dict(row) for row in rows]
     
     def delete_document(self, doc_id: str) -> bool:
         """Delete a document"""
-        if doc_id not in self.metadata:
+        doc_info = self.get_document(doc_id)
+        if doc_info is None:
             return False
         
-        doc_info = self.metadata[doc_id]
         file_path = self.upload_dir / doc_info["saved_as"]
         
         # Delete file
@@ -130,11 +315,11 @@ class DocumentService:
             os.remove(file_path)
         
         # Remove from metadata
-        del self.metadata[doc_id]
-        self._save_metadata()
+        with self._lock:
+            self.conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+            self.conn.commit()
         
         return True
 
-
 # Singleton instance
 document_service = DocumentService()
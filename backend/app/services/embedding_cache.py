@@ -0,0 +1,86 @@
+"""
+Embedding Cache - Persistent SQLite cache for chunk embeddings
+"""
+
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from app.config import settings
+
+
+# SQLite's default limit on host parameters per statement is 999
+_MAX_PARAMS = 900
+
+
+class EmbeddingCache:
+    """Cache of embeddings keyed by (model name, sha256 of the text)"""
+    
+    def __init__(self, db_path: Path = None):
+        self.db_path = db_path or settings.chroma_dir / "emb_cache.db"
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (hash, model)
+            )
+            """
+        )
+        self.conn.commit()
+    
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """Content hash used as the cache key"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    def get_many(self, hashes: List[str], model: str) -> Dict[str, np.ndarray]:
+        """Fetch cached vectors for the given hashes (misses are omitted)"""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        
+        with self._lock:
+            for start in range(0, len(unique), _MAX_PARAMS):
+                batch = unique[start:start + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for hash_, blob in rows:
+                    found[hash_] = np.frombuffer(blob, dtype=np.float32)
+        
+        return found
+    
+    def put_many(self, hashes: List[str], vectors: np.ndarray, model: str):
+        """Store freshly computed vectors"""
+        if not hashes:
+            return
+        
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = [
+            (hash_, model, vectors.shape[1], vector.tobytes())
+            for hash_, vector in zip(hashes, vectors)
+        ]
+        
+        with self._lock:
+            self.conn.executemany(
+                """
+                INSERT INTO embeddings (hash, model, dim, vector) VALUES (?, ?, ?, ?)
+                ON CONFLICT(hash, model) DO UPDATE SET dim = excluded.dim, vector = excluded.vector
+                """,
+                rows
+            )
+            self.conn.commit()
+
+
+# Singleton instance
+embedding_cache = EmbeddingCache()
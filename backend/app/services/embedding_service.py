@@ -3,63 +3,218 @@ Embedding Service - Generate embeddings using local Sentence Transformers
 Fast, free, and no rate limits - perfect for RAG applications.
 """
 
+from collections import OrderedDict
 from typing import List
-from sentence_transformers import SentenceTransformer
+import threading
+import numpy as np
 from app.config import settings
+from app.services.embedding_cache import embedding_cache
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# LRU cache of query embeddings, keyed by the stripped query text
+QUERY_CACHE_SIZE = 1024
+_query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
 
 class EmbeddingService:
     """Service for generating text embeddings using local Sentence Transformers"""
     
     def __init__(self):
-        self.model = None
-        self._initialize()
+        self._model = None
+        self._dim = None
+        self._model_lock = threading.Lock()
+    
+    def _get_model(self):
+        """Load the local embedding model on first use"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    model = self._initialize()
+                    self._dim = model.get_sentence_embedding_dimension()
+                    self._model = model
+        return self._model
+    
+    @property
+    def dim(self) -> int:
+        """Embedding dimension of the loaded model"""
+        self._get_model()
+        return self._dim
     
     def _initialize(self):
         """Initialize the local embedding model"""
         try:
-            logger.info(f"Loading embedding model: {settings.embedding_model}")
-            self.model = SentenceTransformer(settings.embedding_model)
+            if settings.embedding_backend == "onnx":
+                from app.services.onnx_encoder import OnnxEncoder
+                
+                logger.info(f"Loading ONNX embedding model from {settings.onnx_model_dir}")
+                model = OnnxEncoder(settings.onnx_model_dir, quantized=settings.embedding_dtype == "int8")
+                logger.info("Embedding model loaded successfully")
+                return model
+            
+            # Imported here so that torch is only loaded once embeddings are needed
+            from sentence_transformers import SentenceTransformer
+            
+            logger.info(f"Loading embedding model: {settings.embedding_model} ({settings.embedding_dtype})")
+            model = SentenceTransformer(settings.embedding_model)
+            model = self._apply_dtype(model)
             logger.info("Embedding model loaded successfully")
+            return model
         except Exception as e:
             logger.error(f"Failed to load embedding model: {str(e)}")
             raise e
     
-    def get_embedding(self, text: str) -> List[float]:
-        """Get embedding for a single text"""
+    def _apply_dtype(self, model):
+        """Reduce model precision according to settings.embedding_dtype"""
+        dtype = settings.embedding_dtype
+        
+        if dtype == "fp16":
+            if model.device.type == "cuda":
+                return model.half()
+            logger.warning("fp16 embeddings need a CUDA device, falling back to fp32")
+        elif dtype == "int8":
+            if model.device.type == "cpu":
+                import torch
+                return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            logger.warning("int8 embeddings are only supported on CPU, falling back to fp32")
+        
+        return model
+    
+    @property
+    def cache_key(self) -> str:
+        """Model identifier for the embedding cache (backend and precision change the vectors)"""
+        if settings.embedding_backend == "torch" and settings.embedding_dtype == "fp32":
+            # Default key, kept so existing cache entries stay valid
+            return settings.embedding_model
+        return f"{settings.embedding_model}:{settings.embedding_backend}:{settings.embedding_dtype}"
+    
+    def warmup(self):
+        """Load the model and run one throwaway encode, bypassing the caches"""
         try:
-            embedding = self.model.encode(text, convert_to_numpy=True)
-            return embedding.tolist()
+            self._get_model().encode(["warmup"], convert_to_numpy=True, normalize_embeddings=True)
+        except Exception as e:
+            # The first real request retries the load and reports the error
+            logger.warning(f"Embedding model warm-up failed: {e}")
+    
+    def get_embedding(self, text: str) -> np.ndarray:
+        """Get embedding for a single text as a float32 array of shape (D,)"""
+        try:
+            embedding = self._get_model().encode(text, convert_to_numpy=True, normalize_embeddings=True)
+            return embedding.astype(np.float32, copy=False)
         except Exception as e:
             logger.error(f"Embedding error: {e}")
             raise e
     
-    def get_query_embedding(self, text: str) -> List[float]:
-        """Get embedding for a query (same as document embedding for this model)"""
-        return self.get_embedding(text)
+    def get_query_embedding(self, text: str) -> np.ndarray:
+        """Get embedding for a query, served from the LRU cache on repeats"""
+        key = text.strip()
+        
+        with _query_cache_lock:
+            if key in _query_cache:
+                _query_cache.move_to_end(key)
+                return _query_cache[key]
+        
+        embedding = self.get_embedding(key)
+        # Cached arrays are shared between callers, so make them read-only
+        embedding.setflags(write=False)
+        
+        with _query_cache_lock:
+            _query_cache[key] = embedding
+            if len(_query_cache) > QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+        
+        return embedding
+    
+    def get_query_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Get embeddings for several queries as an (N, D) array
+        
+        Queries already in the LRU cache are reused and the rest are encoded
+        in a single model call. Queries are not written to the persistent
+        chunk cache.
+        """
+        keys = [text.strip() for text in texts]
+        
+        with _query_cache_lock:
+            found = {key: _query_cache[key] for key in keys if key in _query_cache}
+            for key in found:
+                _query_cache.move_to_end(key)
+        
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            try:
+                fresh = self._get_model().encode(
+                    missing, batch_size=64, convert_to_numpy=True, normalize_embeddings=True
+                ).astype(np.float32, copy=False)
+            except Exception as e:
+                logger.error(f"Embedding error: {e}")
+                raise e
+            
+            with _query_cache_lock:
+                for key, embedding in zip(missing, fresh):
+                    embedding.setflags(write=False)
+                    found[key] = _query_cache[key] = embedding
+                while len(_query_cache) > QUERY_CACHE_SIZE:
+                    _query_cache.popitem(last=False)
+        
+        return np.stack([found[key] for key in keys])
     
-    def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        """Get embeddings for multiple texts at once (very fast - no delays needed)"""
-        if not texts:
-            return []
+    def get_embeddings_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        Get embeddings for multiple texts, encoding only those not already cached
         
-        logger.info(f"Processing {len(texts)} chunks in batch...")
+        Returns a contiguous float32 array of shape (N, D).
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
         
         try:
-            # Process all texts at once - sentence-transformers handles batching efficiently
-            embeddings = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
-            result = [emb.tolist() for emb in embeddings]
+            hashes = [embedding_cache.hash_text(t) for t in texts]
+            cached = embedding_cache.get_many(hashes, self.cache_key)
+            
+            cached_indices = []
+            uncached_texts = []
+            uncached_indices = []
+            for i, (text, hash_) in enumerate(zip(texts, hashes)):
+                if hash_ in cached:
+                    cached_indices.append(i)
+                else:
+                    uncached_texts.append(text)
+                    uncached_indices.append(i)
+            
+            logger.info(f"Processing {len(texts)} chunks in batch ({len(cached_indices)} cached)...")
+            
+            # Fill a single preallocated buffer in the original order. A fully
+            # cached batch takes the dimension from the cache so the model
+            # doesn't have to be loaded.
+            dim = self.dim if uncached_texts else len(cached[hashes[0]])
+            result = np.empty((len(texts), dim), dtype=np.float32)
+            
+            if cached_indices:
+                result[cached_indices] = np.stack([cached[hashes[i]] for i in cached_indices])
+            
+            if uncached_texts:
+                fresh = self._get_model().encode(
+                    uncached_texts,
+                    batch_size=64,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                    show_progress_bar=True
+                )
+                result[uncached_indices] = fresh
+                embedding_cache.put_many(
+                    [hashes[i] for i in uncached_indices], result[uncached_indices], self.cache_key
+                )
+            
             logger.info(f"Completed all {len(texts)} chunks")
             return result
         except Exception as e:
             logger.error(f"Batch embedding error: {e}")
             raise e
 
-
 # Singleton instance
 embedding_service = EmbeddingService()
@@ -0,0 +1,73 @@
+"""
+ONNX Encoder - Sentence embeddings with onnxruntime, without importing torch
+"""
+
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+import onnxruntime
+from tokenizers import Tokenizer
+
+
+class OnnxEncoder:
+    """
+    Minimal stand-in for SentenceTransformer.encode backed by an exported ONNX model
+    
+    Expects a directory produced by scripts/export_onnx.py containing
+    model.onnx (and optionally model_quantized.onnx) plus tokenizer.json.
+    """
+    
+    def __init__(self, model_dir: Path, quantized: bool = False):
+        model_file = model_dir / ("model_quantized.onnx" if quantized else "model.onnx")
+        if not model_file.exists():
+            raise FileNotFoundError(
+                f"{model_file} not found - run scripts/export_onnx.py first"
+            )
+        
+        self.session = onnxruntime.InferenceSession(str(model_file), providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_padding()
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        """Hidden size of the exported model"""
+        return self.session.get_outputs()[0].shape[-1]
+    
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ) -> np.ndarray:
+        """Encode text(s) with mean pooling over the last hidden state"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(sentences[start:start + batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+            
+            hidden = self.session.run(None, feeds)[0]
+            
+            # Mean pooling over non-padding tokens
+            mask = attention_mask[..., np.newaxis].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            batches.append(pooled.astype(np.float32))
+        
+        embeddings = np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        
+        if normalize_embeddings and len(embeddings):
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        
+        return embeddings[0] if single else embeddings
@@ -0,0 +1,15 @@
+"""
+PDF Worker - Page-range text extraction run in worker processes
+
+Kept free of app imports so that spawned workers only load PyMuPDF.
+"""
+
+from typing import List
+
+import fitz  # PyMuPDF
+
+
+def extract_page_range(file_path: str, start: int, stop: int) -> List[str]:
+    """Extract pages [start, stop) with a document handle private to this worker"""
+    with fitz.open(file_path) as doc:
+        return [doc[page_num].get_textpage().extractText() for page_num in range(start, stop)]
@@ -2,35 +2,41 @@
 RAG Service - Retrieval Augmented Generation using Gemini
 """
 
-import json
+import asyncio
+import atexit
+import logging
+import os
+import re
+import threading
 from pathlib import Path
 from datetime import datetime
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Union
 import uuid
 
+import aiofiles
+import numpy as np
+import orjson
 import google.generativeai as genai
 
 from app.config import settings
 from app.services.vector_store import vector_store
+from app.services.embedding_service import embedding_service
+from app.services.answer_cache import answer_cache
 from app.models.schemas import ChatMode, SourceChunk, Message
 
 
-# Prompt templates for different modes
-PROMPTS = {
+logger = logging.getLogger(__name__)
+
+# Static instructions for each mode, sent as the model's system instruction so
+# every request shares the same prefix and only the context and question vary
+SYSTEM_PROMPTS = {
     ChatMode.QA: """You are a helpful study assistant. Answer the following question based ONLY on the provided context from the student's documents.
 
 **Rules:**
 1. Only use information from the provided context
 2. If the answer is not in the context, say "I couldn't find this information in your documents."
 3. Be concise and clear
-4. Cite which document the information comes from
-
-**Context:**
-{context}
-
-**Question:** {question}
-
-**Answer:**""",
+4. Cite which document the information comes from""",
 
     ChatMode.SUMMARY: """You are a helpful study assistant. Create a comprehensive summary of the provided content from the student's documents.
 
@@ -38,14 +44,7 @@ PROMPTS = {
 1. Summarize the key points from the context
 2. Organize the summary with bullet points or sections
 3. Be concise but complete
-4. Include the main concepts and important details
-
-**Content to Summarize:**
-{context}
-
-**User Request:** {question}
-
-**Summary:**""",
+4. Include the main concepts and important details""",
 
     ChatMode.QUIZ: """You are a helpful study assistant. Generate a quiz based on the provided content from the student's documents.
 
@@ -54,9 +53,26 @@ PROMPTS = {
 2. Each question should have 4 options (A, B, C, D)
 3. Mark the correct answer
 4. Questions should test understanding, not just memorization
-5. Format clearly with question numbers
+5. Format clearly with question numbers"""
+}
+
+# Per-request prompt templates for different modes
+PROMPTS = {
+    ChatMode.QA: """**Context:**
+{context}
 
-**Content:**
+**Question:** {question}
+
+**Answer:**""",
+
+    ChatMode.SUMMARY: """**Content to Summarize:**
+{context}
+
+**User Request:** {question}
+
+**Summary:**""",
+
+    ChatMode.QUIZ: """**Content:**
 {context}
 
 **User Request:** {question}
@@ -64,22 +80,55 @@ PROMPTS = {
 **Quiz:**"""
 }
 
+# Templates split around {context} and {question} (in that order), so prompts
+# are built by concatenation instead of str.format on every request
+PROMPT_PARTS = {
+    mode: tuple(re.split(r"\{context\}|\{question\}", template))
+    for mode, template in PROMPTS.items()
+}
+
+# Seconds to wait after a history change before writing it to disk
+HISTORY_FLUSH_DELAY = 1.0
+
 
 class RAGService:
     """Service for RAG-based question answering"""
     
     def __init__(self):
         self.history_dir = settings.history_dir
-        self.model = None
+        # One model per mode, each carrying that mode's system instruction
+        self.models: Dict[ChatMode, genai.GenerativeModel] = {}
+        # conversation_id -> history, loaded lazily and written back in batches
+        self._histories: Dict[str, dict] = {}
+        # conversation_id -> listing summary, built on the first listing
+        self._convo_index: Optional[Dict[str, dict]] = None
+        # Conversations changed since their file was last written
+        self._dirty: Set[str] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # Flushes run in the background; keep references so tasks aren't collected
+        self._pending_writes: Set[asyncio.Task] = set()
+        self._write_lock = asyncio.Lock()
         self._initialize_model()
     
     def _initialize_model(self):
-        """Initialize the Gemini chat model"""
+        """Initialize the Gemini chat models"""
         if settings.gemini_api_key:
             genai.configure(api_key=settings.gemini_api_key)
-            self.model = genai.GenerativeModel("gemini-1.5-flash")
+            self.models = {
+                mode: genai.GenerativeModel(settings.chat_model, system_instruction=instruction)
+                for mode, instruction in SYSTEM_PROMPTS.items()
+            }
+            # Pay the connection and auth setup now rather than on the first question
+            threading.Thread(target=self._warm_up, daemon=True).start()
     
-    def query(
+    def _warm_up(self):
+        """Send a minimal request to the chat model"""
+        try:
+            self.models[ChatMode.QA].generate_content("ok", generation_config={"max_output_tokens": 1})
+        except Exception as e:
+            logger.warning(f"Gemini warm-up request failed: {e}")
+    
+    async def query(
         self,
         question: str,
         mode: ChatMode = ChatMode.QA,
@@ -96,22 +145,122 @@ class RAGService:
         Returns:
             Dict with answer, sources, and conversation_id
         """
-        # Check if model is initialized
-        if not self.model:
+        # Generate new conversation ID if not provided
+        if not conversation_id:
+            conversation_id = str(uuid.uuid4())[:8]
+        
+        prepared = await self._prepare(question, mode, conversation_id)
+        if isinstance(prepared, dict):
+            return prepared
+        prompt, query_embedding, search_results = prepared
+        
+        # Generate response with error handling
+        try:
+            response = await self.models[mode].generate_content_async(prompt)
+            answer = response.text
+        except Exception as e:
             return {
-                "answer": "⚠️ Gemini API key is not configured. Please add GEMINI_API_KEY to your .env file.",
+                "answer": self._error_message(e),
                 "sources": [],
-                "conversation_id": conversation_id or str(uuid.uuid4())[:8],
+                "conversation_id": conversation_id,
                 "mode": mode
             }
         
-        # Generate new conversation ID if not provided
+        sources = self._format_sources(search_results)
+        self._record_answer(question, mode, conversation_id, query_embedding, answer, sources)
+        
+        return {
+            "answer": answer,
+            "sources": sources,
+            "conversation_id": conversation_id,
+            "mode": mode
+        }
+    
+    async def query_stream(
+        self,
+        question: str,
+        mode: ChatMode = ChatMode.QA,
+        conversation_id: Optional[str] = None
+    ) -> AsyncIterator[dict]:
+        """
+        Process a query using RAG, yielding the answer as it is generated
+        
+        Yields a "meta" event with conversation_id, mode and sources, then
+        "token" events carrying answer text, then "done" (or "error" if
+        generation fails part way).
+        """
         if not conversation_id:
             conversation_id = str(uuid.uuid4())[:8]
         
+        prepared = await self._prepare(question, mode, conversation_id)
+        
+        # Cached answers and early errors arrive in one piece
+        if isinstance(prepared, dict):
+            yield self._meta_event(conversation_id, mode, prepared["sources"])
+            yield {"type": "token", "text": prepared["answer"]}
+            yield {"type": "done"}
+            return
+        prompt, query_embedding, search_results = prepared
+        
+        sources = self._format_sources(search_results)
+        yield self._meta_event(conversation_id, mode, sources)
+        
+        parts = []
+        try:
+            response = await self.models[mode].generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                parts.append(chunk.text)
+                yield {"type": "token", "text": chunk.text}
+        except Exception as e:
+            yield {"type": "error", "text": self._error_message(e)}
+            return
+        
+        self._record_answer(question, mode, conversation_id, query_embedding, "".join(parts), sources)
+        yield {"type": "done"}
+    
+    async def _prepare(
+        self,
+        question: str,
+        mode: ChatMode,
+        conversation_id: str
+    ) -> Union[dict, Tuple[str, np.ndarray, List[dict]]]:
+        """
+        Retrieve context and build the prompt for a question
+        
+        Returns:
+            A finished result dict (cached answer or error), or the prompt,
+            query embedding and search results to generate from
+        """
+        # Check if model is initialized
+        if not self.models:
+            return {
+                "answer": "⚠️ Gemini API key is not configured. Please add GEMINI_API_KEY to your .env file.",
+                "sources": [],
+                "conversation_id": conversation_id,
+                "mode": mode
+            }
+        
+        # Cached answers are only valid for the model and documents they came from
+        answer_cache.sync((embedding_service.cache_key, *vector_store.revision))
+        
+        # Exact repeat of an earlier question: skip search and generation
+        cached = answer_cache.get(question, mode.value)
+        if cached is not None:
+            return self._cached_response(cached, question, mode, conversation_id)
+        
         # Retrieve relevant documents
         try:
-            search_results = vector_store.search(question)
+            query_embedding = await asyncio.to_thread(embedding_service.get_query_embedding, question)
+            
+            # Probe the answer cache and search the index concurrently with the same embedding
+            cached, search_results = await asyncio.gather(
+                asyncio.to_thread(answer_cache.get_similar, query_embedding, mode.value),
+                asyncio.to_thread(vector_store.search_with_vector, query_embedding)
+            )
+            
+            # Near-duplicate of an earlier question: skip generation
+            if cached is not None:
+                return self._cached_response(cached, question, mode, conversation_id)
         except Exception as e:
             return {
                 "answer": f"⚠️ Error searching documents: {str(e)}",
@@ -131,48 +280,79 @@ class RAGService:
         # Build context from search results
         context = self._build_context(search_results)
         
-        # Get the appropriate prompt template
-        prompt = PROMPTS[mode].format(
-            context=context,
-            question=question
-        )
+        # Fill the appropriate prompt template
+        prefix, mid, suffix = PROMPT_PARTS[mode]
+        prompt = "".join((prefix, context, mid, question, suffix))
         
-        # Generate response with error handling
-        try:
-            response = self.model.generate_content(prompt)
-            answer = response.text
-        except Exception as e:
-            error_msg = str(e)
-            if "429" in error_msg or "quota" in error_msg.lower():
-                answer = "⚠️ API rate limit reached. Please wait a moment and try again."
-            elif "API key" in error_msg:
-                answer = "⚠️ Invalid API key. Please check your GEMINI_API_KEY in the .env file."
-            else:
-                answer = f"⚠️ Error generating response: {error_msg}"
-            
-            return {
-                "answer": answer,
-                "sources": [],
-                "conversation_id": conversation_id,
-                "mode": mode
-            }
+        return prompt, query_embedding, search_results
+    
+    @staticmethod
+    def _error_message(error: Exception) -> str:
+        """User-facing message for a failed Gemini call"""
+        error_msg = str(error)
+        if "429" in error_msg or "quota" in error_msg.lower():
+            return "⚠️ API rate limit reached. Please wait a moment and try again."
+        elif "API key" in error_msg:
+            return "⚠️ Invalid API key. Please check your GEMINI_API_KEY in the .env file."
+        return f"⚠️ Error generating response: {error_msg}"
+    
+    @staticmethod
+    def _format_sources(search_results: List[dict]) -> List[SourceChunk]:
+        """Top 3 search results as truncated source chunks"""
+        sources = []
         
-        # Format sources
-        sources = [
-            SourceChunk(
+        for result in search_results[:3]:  # Top 3 sources
+            content = result["content"]
+            if len(content) > 200:
+                content = content[:200] + "..."
+            sources.append(SourceChunk(
                 document=result["metadata"].get("filename", "Unknown"),
-                content=result["content"][:200] + "..." if len(result["content"]) > 200 else result["content"],
+                content=content,
                 relevance_score=result["relevance_score"]
-            )
-            for result in search_results[:3]  # Top 3 sources
-        ]
+            ))
+        
+        return sources
+    
+    @staticmethod
+    def _meta_event(conversation_id: str, mode: ChatMode, sources: List[SourceChunk]) -> dict:
+        """First event of a streamed response"""
+        return {
+            "type": "meta",
+            "conversation_id": conversation_id,
+            "mode": mode.value,
+            "sources": [source.model_dump() for source in sources]
+        }
+    
+    def _record_answer(
+        self,
+        question: str,
+        mode: ChatMode,
+        conversation_id: str,
+        query_embedding: np.ndarray,
+        answer: str,
+        sources: List[SourceChunk]
+    ):
+        """Cache a generated answer and save the exchange to history"""
+        answer_cache.put(question, mode.value, query_embedding, answer, [s.model_dump() for s in sources])
         
         # Save to history
         self._save_to_history(conversation_id, question, answer, mode)
+    
+    def _cached_response(
+        self,
+        cached: Tuple[str, List[dict]],
+        question: str,
+        mode: ChatMode,
+        conversation_id: str
+    ) -> dict:
+        """Answer from the cache, still recording the exchange in history"""
+        answer, sources = cached
+        
+        self._save_to_history(conversation_id, question, answer, mode)
         
         return {
             "answer": answer,
-            "sources": sources,
+            "sources": [SourceChunk(**source) for source in sources],
             "conversation_id": conversation_id,
             "mode": mode
         }
@@ -195,20 +375,17 @@ class RAGService:
         answer: str,
         mode: ChatMode
     ):
-        """Save conversation to history file"""
-        history_file = self.history_dir / f"{conversation_id}.json"
-        
+        """Append the exchange to the conversation and schedule a write to disk"""
         # Load existing history or create new
-        if history_file.exists():
-            with open(history_file, "r", encoding="utf-8") as f:
-                history = json.load(f)
-        else:
+        history = self.get_history(conversation_id)
+        if history is None:
             history = {
                 "conversation_id": conversation_id,
                 "messages": [],
                 "created_at": datetime.now().isoformat(),
                 "updated_at": datetime.now().isoformat()
             }
+            self._histories[conversation_id] = history
         
         # Add messages
         timestamp = datetime.now().isoformat()
@@ -218,45 +395,118 @@ class RAGService:
         ])
         history["updated_at"] = timestamp
         
-        # Save
-        with open(history_file, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
+        if self._convo_index is not None:
+            self._convo_index[conversation_id] = self._summarize(history)
+        
+        # Debounce: one flush per HISTORY_FLUSH_DELAY covers every change made meanwhile
+        self._dirty.add(conversation_id)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(HISTORY_FLUSH_DELAY, self._start_flush)
+    
+    def _start_flush(self):
+        """Timer callback that starts a background flush"""
+        self._flush_handle = None
+        task = asyncio.create_task(self._flush_async())
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+    
+    async def _flush_async(self):
+        """Write changed conversations without blocking the event loop"""
+        async with self._write_lock:
+            dirty, self._dirty = self._dirty, set()
+            
+            for conversation_id in dirty:
+                history = self._histories.get(conversation_id)
+                if history is None:
+                    continue
+                
+                # Replace atomically so readers never see a partial file
+                history_file = self.history_dir / f"{conversation_id}.json"
+                tmp_file = history_file.with_suffix(".tmp")
+                async with aiofiles.open(tmp_file, "wb") as f:
+                    await f.write(orjson.dumps(history))
+                os.replace(tmp_file, history_file)
+                
+                # Deleted while the write was in flight
+                if conversation_id not in self._histories:
+                    history_file.unlink(missing_ok=True)
+    
+    def flush(self):
+        """Write every changed conversation to disk now"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        for conversation_id in self._dirty:
+            history = self._histories.get(conversation_id)
+            if history is None:
+                continue
+            
+            history_file = self.history_dir / f"{conversation_id}.json"
+            tmp_file = history_file.with_suffix(".tmp")
+            tmp_file.write_bytes(orjson.dumps(history))
+            os.replace(tmp_file, history_file)
+        
+        self._dirty.clear()
+    
+    @staticmethod
+    def _summarize(history: dict) -> dict:
+        """Listing entry for a conversation"""
+        return {
+            "conversation_id": history["conversation_id"],
+            "message_count": len(history["messages"]),
+            "created_at": history["created_at"],
+            "updated_at": history["updated_at"]
+        }
     
     def get_history(self, conversation_id: str) -> Optional[dict]:
         """Get conversation history"""
-        history_file = self.history_dir / f"{conversation_id}.json"
+        history = self._histories.get(conversation_id)
+        if history is not None:
+            return history
         
+        history_file = self.history_dir / f"{conversation_id}.json"
         if not history_file.exists():
             return None
         
-        with open(history_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+        history = orjson.loads(history_file.read_bytes())
+        self._histories[conversation_id] = history
+        return history
     
     def delete_history(self, conversation_id: str) -> bool:
         """Delete conversation history"""
         history_file = self.history_dir / f"{conversation_id}.json"
+        # Also drops changes that haven't been flushed yet
+        cached = self._histories.pop(conversation_id, None)
+        self._dirty.discard(conversation_id)
+        if self._convo_index is not None:
+            self._convo_index.pop(conversation_id, None)
         
         if history_file.exists():
             history_file.unlink()
             return True
-        return False
+        return cached is not None
     
     def list_conversations(self) -> List[dict]:
         """List all conversations"""
-        conversations = []
-        
-        for file in self.history_dir.glob("*.json"):
-            with open(file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                conversations.append({
-                    "conversation_id": data["conversation_id"],
-                    "message_count": len(data["messages"]),
-                    "created_at": data["created_at"],
-                    "updated_at": data["updated_at"]
-                })
-        
-        return sorted(conversations, key=lambda x: x["updated_at"], reverse=True)
-
+        if self._convo_index is None:
+            # Scan the history files once; writes keep the index current afterwards
+            index = {}
+            for file in self.history_dir.glob("*.json"):
+                history = self._histories.get(file.stem)
+                if history is None:
+                    history = orjson.loads(file.read_bytes())
+                index[file.stem] = self._summarize(history)
+            
+            # Conversations that haven't been flushed yet
+            for conversation_id, history in self._histories.items():
+                index.setdefault(conversation_id, self._summarize(history))
+            
+            self._convo_index = index
+        
+        return sorted(self._convo_index.values(), key=lambda x: x["updated_at"], reverse=True)
 
 # Singleton instance
 rag_service = RAGService()
+# Write out history changes still waiting for their debounced flush
+atexit.register(rag_service.flush)
@@ -1,66 +1,371 @@
 """
-Vector Store Service - ChromaDB for storing and searching embeddings
+Vector Store Service - FAISS index for storing and searching embeddings
 """
 
-from typing import List, Dict, Any, Optional
-import chromadb
-from chromadb.config import Settings as ChromaSettings
+from typing import List, Dict, Any, Optional, Set, Tuple
+import logging
+import os
+import pickle
+import threading
+
+import faiss
+import numpy as np
 
 from app.config import settings
 from app.services.embedding_service import embedding_service
 
 
+logger = logging.getLogger(__name__)
+
+# Leave half the cores for the embedding model and request handling
+faiss.omp_set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+
+# Rebuild an index that can't remove vectors once this share of it is deleted
+TOMBSTONE_REBUILD_FRACTION = 0.25
+# Vectors reconstructed at a time while rebuilding
+REBUILD_BATCH_SIZE = 1 << 16
+
+
 class VectorStore:
-    """ChromaDB-based vector store for document chunks"""
+    """FAISS vector store for document chunks"""
     
     def __init__(self):
-        # Initialize ChromaDB with persistence
-        self.client = chromadb.PersistentClient(
-            path=str(settings.chroma_dir),
-            settings=ChromaSettings(anonymized_telemetry=False)
-        )
-        
-        # Get or create the main collection
-        self.collection = self.client.get_or_create_collection(
-            name="documents",
-            metadata={"hnsw:space": "cosine"}
-        )
+        self.index_file = settings.index_dir / "index.faiss"
+        self.payload_file = settings.index_dir / "payloads.pkl"
+        self.pending_file = settings.index_dir / "pending.npy"
+        self.pending_ids_file = settings.index_dir / "pending_ids.npy"
+        self.doc_map_file = settings.index_dir / "doc_chunks.pkl"
+        self._lock = threading.RLock()
+        
+        # Created on the first add (or once enough vectors to train IVF-PQ
+        # have been buffered), when the embedding dimension is known
+        self.index: Optional[faiss.Index] = None
+        # Vectors waiting for IVF-PQ training, searched by brute force meanwhile
+        self.pending: Optional[np.ndarray] = None
+        self.pending_ids: Optional[np.ndarray] = None
+        # FAISS id -> (chunk text, chunk metadata)
+        self.payloads: Dict[int, Tuple[str, dict]] = {}
+        # doc_id -> FAISS ids of its chunks
+        self.doc_map: Dict[str, List[int]] = {}
+        # Id for the next chunk, never reused
+        self.next_id = 0
+        # Ids of deleted vectors still held by an index that can't remove them (HNSW)
+        self.tombstones: Set[int] = set()
+        # Search-time selector skipping the tombstones, built when first needed
+        self._exclude: Optional[Tuple[faiss.IDSelectorBatch, faiss.IDSelectorNot]] = None
+        # Background thread rebuilding the index without its tombstones, if one is running
+        self._rebuild_thread: Optional[threading.Thread] = None
+        
+        self._load()
+        if not self.payload_file.exists():
+            self._migrate_from_chroma()
+    
+    def _load(self):
+        """Load a persisted index, pending vectors and payloads"""
+        if not self.payload_file.exists():
+            return
+        
+        if self.index_file.exists():
+            self.index = faiss.read_index(str(self.index_file))
+            self._configure(self.index)
+        if self.pending_file.exists():
+            self.pending = np.load(self.pending_file).astype(np.float32)
+            if self.pending_ids_file.exists():
+                self.pending_ids = np.load(self.pending_ids_file)
+            else:
+                # Written when ids were positional
+                self.pending_ids = np.arange(len(self.pending), dtype=np.int64)
+        with open(self.payload_file, "rb") as f:
+            self.payloads = pickle.load(f)
+            try:
+                self.next_id = pickle.load(f)
+            except EOFError:
+                # Written when ids were positional
+                self.next_id = self._total
+        
+        if self.doc_map_file.exists():
+            with open(self.doc_map_file, "rb") as f:
+                self.doc_map = pickle.load(f)
+        else:
+            # Stores written before the map existed
+            for id_, (_, metadata) in self.payloads.items():
+                if "doc_id" in metadata:
+                    self.doc_map.setdefault(metadata["doc_id"], []).append(id_)
+        
+        self._load_tombstones()
+    
+    def _load_tombstones(self):
+        """Find deleted vectors that are still held by the index"""
+        if self.index is None or self.index.ntotal == len(self.payloads):
+            return
+        
+        if self._supports_remove():
+            # Left over from before deletes removed vectors: remove them now
+            live = np.fromiter(self.payloads, dtype=np.int64, count=len(self.payloads))
+            self.index.remove_ids(faiss.IDSelectorNot(faiss.IDSelectorBatch(live)))
+            self._persist()
+            return
+        
+        if isinstance(self.index, faiss.IndexIDMap2):
+            held = faiss.vector_to_array(self.index.id_map)
+        else:
+            # Index written before ids were mapped: ids are positional
+            held = np.arange(self.index.ntotal)
+        self.tombstones = set(held.tolist()) - self.payloads.keys()
+        self._maybe_rebuild()
+    
+    def _persist(self):
+        """Write the index, pending vectors and payloads to disk atomically"""
+        if self.index is not None:
+            tmp_index = self.index_file.with_suffix(".tmp")
+            faiss.write_index(self.index, str(tmp_index))
+            os.replace(tmp_index, self.index_file)
+        
+        if self.pending is not None:
+            tmp_pending = self.pending_file.with_suffix(".tmp.npy")
+            # Half precision on disk; only the brute-force stopgap reads it back
+            np.save(tmp_pending, self.pending.astype(np.float16))
+            os.replace(tmp_pending, self.pending_file)
+            tmp_pending_ids = self.pending_ids_file.with_suffix(".tmp.npy")
+            np.save(tmp_pending_ids, self.pending_ids)
+            os.replace(tmp_pending_ids, self.pending_ids_file)
+        else:
+            self.pending_file.unlink(missing_ok=True)
+            self.pending_ids_file.unlink(missing_ok=True)
+        
+        tmp_payloads = self.payload_file.with_suffix(".tmp")
+        with open(tmp_payloads, "wb") as f:
+            pickle.dump(self.payloads, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self.next_id, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_payloads, self.payload_file)
+        
+        tmp_doc_map = self.doc_map_file.with_suffix(".tmp")
+        with open(tmp_doc_map, "wb") as f:
+            pickle.dump(self.doc_map, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_doc_map, self.doc_map_file)
+    
+    def _migrate_from_chroma(self):
+        """One-time import of chunks from the legacy ChromaDB store"""
+        if not (settings.chroma_dir / "chroma.sqlite3").exists():
+            return
+        
+        try:
+            import chromadb
+        except ImportError:
+            logger.warning("Found a legacy ChromaDB store but chromadb is not installed - re-upload documents to index them")
+            return
+        
+        try:
+            collection = chromadb.PersistentClient(path=str(settings.chroma_dir)).get_collection("documents")
+            data = collection.get(include=["embeddings", "documents", "metadatas"])
+        except Exception as e:
+            logger.warning(f"Could not read legacy ChromaDB store: {e}")
+            return
+        
+        if data["ids"]:
+            logger.info(f"Importing {len(data['ids'])} chunks from ChromaDB")
+            self._add_vectors(np.asarray(data["embeddings"], dtype=np.float32), data["documents"], data["metadatas"])
+    
+    @staticmethod
+    def _base(index: faiss.Index) -> faiss.Index:
+        """The index wrapped by an id map, or the index itself"""
+        if isinstance(index, faiss.IndexIDMap2):
+            return faiss.downcast_index(index.index)
+        return index
+    
+    def _configure(self, index: faiss.Index):
+        """Apply search-time parameters"""
+        index = self._base(index)
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = settings.hnsw_ef_search
+        elif isinstance(index, faiss.IndexIVF):
+            index.nprobe = settings.ivf_nprobe
+    
+    def _create_index(self, dim: int) -> faiss.Index:
+        """Create an empty id-mapped index over inner product (cosine on normalized vectors)"""
+        fp16 = settings.vector_dtype == "fp16"
+        
+        if settings.vector_index_type == "flat":
+            if fp16:
+                index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexFlatIP(dim)
+        elif settings.vector_index_type == "ivfpq":
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFPQ(quantizer, dim, settings.ivf_nlist, settings.pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if fp16:
+                index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_fp16, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexHNSWFlat(dim, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = settings.hnsw_ef_construction
+        
+        # Explicit ids survive deletes. IVF stores ids in its inverted lists
+        # already, and the id map's compaction on removal would break them.
+        if not isinstance(index, faiss.IndexIVF):
+            index = faiss.IndexIDMap2(index)
+        self._configure(index)
+        return index
+    
+    def _maybe_rebuild(self):
+        """Start a background rebuild once too many vectors are tombstones (call with the lock held)"""
+        if self._rebuild_thread is not None or len(self.tombstones) <= TOMBSTONE_REBUILD_FRACTION * self.index.ntotal:
+            return
+        
+        self._rebuild_thread = threading.Thread(target=self._rebuild, name="vector-index-rebuild", daemon=True)
+        self._rebuild_thread.start()
+    
+    def _rebuild(self):
+        """
+        Rebuild the index from its live vectors and swap it in
+        
+        Building the graph is the slow part and runs without the lock, so
+        searches, uploads and deletes carry on against the old index. The
+        lock is only taken to copy vectors out of it and for the swap, which
+        also applies the chunks added and deleted in the meantime.
+        """
+        try:
+            with self._lock:
+                old = self.index
+                live = np.array(sorted(self.payloads), dtype=np.int64)
+                built_up_to = self.next_id
+                logger.info(f"Rebuilding vector index: {len(live)} live, {len(self.tombstones)} deleted")
+            
+            base = self._base(old)
+            if isinstance(base, faiss.IndexHNSWSQ):
+                fresh = faiss.IndexHNSWSQ(old.d, faiss.ScalarQuantizer.QT_fp16, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            elif isinstance(base, faiss.IndexHNSW):
+                fresh = faiss.IndexHNSWFlat(old.d, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            else:
+                fresh = faiss.IndexFlatIP(old.d)
+            if isinstance(fresh, faiss.IndexHNSW):
+                fresh.hnsw.efConstruction = settings.hnsw_ef_construction
+            fresh = faiss.IndexIDMap2(fresh)
+            self._configure(fresh)
+            
+            for start in range(0, len(live), REBUILD_BATCH_SIZE):
+                ids = live[start:start + REBUILD_BATCH_SIZE]
+                # The old index only ever grows, but adds to it must not race the copy
+                with self._lock:
+                    vectors = old.reconstruct_batch(ids)
+                fresh.add_with_ids(vectors, ids)
+            
+            with self._lock:
+                added = np.array(sorted(id_ for id_ in self.payloads if id_ >= built_up_to), dtype=np.int64)
+                if len(added):
+                    fresh.add_with_ids(old.reconstruct_batch(added), added)
+                deleted = live[~np.isin(live, np.fromiter(self.payloads, dtype=np.int64, count=len(self.payloads)))]
+                
+                self.index = fresh
+                self.tombstones = set(deleted.tolist())
+                self._exclude = None
+                self._rebuild_thread = None
+                self._persist()
+                self._maybe_rebuild()
+        except Exception as e:
+            logger.error(f"Vector index rebuild failed: {e}")
+            with self._lock:
+                self._rebuild_thread = None
+    
+    def _search_params(self) -> Optional[faiss.SearchParameters]:
+        """Search parameters that skip tombstones, or None when there are none"""
+        if not self.tombstones:
+            return None
+        
+        if self._exclude is None:
+            # The batch selector must stay referenced while the Not selector wraps it
+            batch = faiss.IDSelectorBatch(np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones)))
+            self._exclude = (batch, faiss.IDSelectorNot(batch))
+        
+        if isinstance(self._base(self.index), faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=self._exclude[1], efSearch=settings.hnsw_ef_search)
+        return faiss.SearchParameters(sel=self._exclude[1])
+    
+    def _has_ids(self) -> bool:
+        """Whether the index takes explicit ids"""
+        return isinstance(self.index, (faiss.IndexIDMap2, faiss.IndexIVF))
+    
+    def _supports_remove(self) -> bool:
+        """Whether deleted vectors can be removed instead of tombstoned"""
+        return self._has_ids() and not isinstance(self._base(self.index), faiss.IndexHNSW)
+    
+    @property
+    def _total(self) -> int:
+        """Number of vectors held, whether indexed or pending"""
+        pending = len(self.pending) if self.pending is not None else 0
+        return (self.index.ntotal if self.index is not None else 0) + pending
+    
+    @property
+    def revision(self) -> Tuple[int, int]:
+        """Changes whenever chunks are added or deleted"""
+        return self.next_id, len(self.payloads)
+    
+    def _add_vectors(self, vectors: np.ndarray, texts: List[str], metadatas: List[dict]):
+        """Normalize and index vectors, storing their payloads under new ids"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        
+        with self._lock:
+            start = self.next_id
+            ids = np.arange(start, start + len(vectors), dtype=np.int64)
+            self.next_id += len(vectors)
+            
+            if settings.vector_index_type == "ivfpq" and self.index is None:
+                # Buffer until there are enough vectors to train the quantizers
+                if self.pending is None:
+                    self.pending, self.pending_ids = vectors, ids
+                else:
+                    self.pending = np.concatenate([self.pending, vectors])
+                    self.pending_ids = np.concatenate([self.pending_ids, ids])
+                # ~40 points per centroid, for both the coarse lists and the 256 PQ codes
+                if len(self.pending) >= 40 * max(settings.ivf_nlist, 256):
+                    index = self._create_index(vectors.shape[1])
+                    index.train(self.pending)
+                    index.add_with_ids(self.pending, self.pending_ids)
+                    self.index, self.pending, self.pending_ids = index, None, None
+            else:
+                if self.index is None:
+                    self.index = self._create_index(vectors.shape[1])
+                if self._has_ids():
+                    self.index.add_with_ids(vectors, ids)
+                else:
+                    # Index written before ids were mapped: ids stay positional
+                    self.index.add(vectors)
+            
+            for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+                self.payloads[start + i] = (text, metadata)
+                if "doc_id" in metadata:
+                    self.doc_map.setdefault(metadata["doc_id"], []).append(start + i)
+            
+            self._persist()
     
     def is_initialized(self) -> bool:
         """Check if vector store is initialized"""
-        return self.collection is not None
+        return self.payloads is not None
     
-    def add_documents(self, chunks: List[dict], doc_id: str) -> int:
+    def add_documents(self, texts: List[str], base_meta: dict) -> int:
         """
         Add document chunks to the vector store
         
         Args:
-            chunks: List of dicts with 'content' and 'metadata' keys
-            doc_id: Document ID for reference
-            
+            texts: Chunk contents, in chunk order
+            base_meta: Metadata shared by all chunks (must include 'doc_id')
+        
         Returns:
             Number of chunks added
         """
-        if not chunks:
+        if not texts:
             return 0
         
         # Generate embeddings
-        texts = [chunk["content"] for chunk in chunks]
         embeddings = embedding_service.get_embeddings_batch(texts)
         
-        # Prepare data for ChromaDB
-        ids = [f"{doc_id}_{i}" for i in range(len(chunks))]
-        metadatas = [chunk["metadata"] for chunk in chunks]
+        # chunk_index is positional
+        metadatas = [{**base_meta, "chunk_index": i} for i in range(len(texts))]
         
-        # Add to collection
-        self.collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            documents=texts,
-            metadatas=metadatas
-        )
+        self._add_vectors(embeddings, texts, metadatas)
         
-        return len(chunks)
+        return len(texts)
     
     def search(self, query: str, n_results: int = None) -> List[Dict[str, Any]]:
         """
@@ -69,7 +374,7 @@ class VectorStore:
         Args:
             query: Search query
             n_results: Number of results to return
-            
+        
         Returns:
             List of matching documents with scores
         """
@@ -79,36 +384,102 @@ class VectorStore:
         # Get query embedding
         query_embedding = embedding_service.get_query_embedding(query)
         
-        # Search
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results,
-            include=["documents", "metadatas", "distances"]
-        )
-        
-        # Format results
-        formatted = []
-        if results["documents"] and results["documents"][0]:
-            for i, doc in enumerate(results["documents"][0]):
-                formatted.append({
-                    "content": doc,
-                    "metadata": results["metadatas"][0][i] if results["metadatas"] else {},
-                    "distance": results["distances"][0][i] if results["distances"] else 0,
-                    "relevance_score": 1 - (results["distances"][0][i] if results["distances"] else 0)
-                })
-        
-        return formatted
+        return self.search_with_vector(query_embedding, n_results)
+    
+    def search_with_vector(self, query_embedding: np.ndarray, n_results: int = None) -> List[Dict[str, Any]]:
+        """Search with an already computed query embedding"""
+        if n_results is None:
+            n_results = settings.top_k_results
+        
+        return self._search_vectors(np.asarray(query_embedding)[np.newaxis], n_results)[0]
+    
+    def search_batch(self, queries: List[str], n_results: int = None) -> List[List[Dict[str, Any]]]:
+        """
+        Search for several queries at once
+        
+        Embeds all queries in one model call and runs a single index search
+        over the query matrix.
+        
+        Returns:
+            One result list per query, in query order
+        """
+        if not queries:
+            return []
+        if n_results is None:
+            n_results = settings.top_k_results
+        
+        query_embeddings = embedding_service.get_query_embeddings(queries)
+        
+        return self._search_vectors(query_embeddings, n_results)
+    
+    def _search_vectors(self, query_embeddings: np.ndarray, n_results: int) -> List[List[Dict[str, Any]]]:
+        """Search the index with an (n_queries, dim) matrix"""
+        query_embeddings = np.array(query_embeddings, dtype=np.float32)
+        faiss.normalize_L2(query_embeddings)
+        
+        with self._lock:
+            if not self.payloads:
+                return [[] for _ in range(len(query_embeddings))]
+            
+            if n_results <= 0:
+                return [[] for _ in range(len(query_embeddings))]
+            
+            if self.index is not None:
+                scores, ids = self.index.search(query_embeddings, n_results, params=self._search_params())
+            else:
+                # IVF-PQ not trained yet: exact search over the pending vectors
+                k = min(len(self.pending), n_results)
+                all_scores = query_embeddings @ self.pending.T
+                # Select the k best in linear time, then sort only those
+                top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+                top_scores = np.take_along_axis(all_scores, top, axis=1)
+                order = np.argsort(-top_scores, axis=1)
+                scores = np.take_along_axis(top_scores, order, axis=1)
+                ids = self.pending_ids[np.take_along_axis(top, order, axis=1)]
+            
+            # Format results (inner product of normalized vectors is the cosine similarity)
+            results = []
+            for row_scores, row_ids in zip(scores, ids):
+                formatted = []
+                for score, id_ in zip(row_scores, row_ids):
+                    if id_ == -1 or id_ not in self.payloads:
+                        continue
+                    text, metadata = self.payloads[id_]
+                    formatted.append({
+                        "content": text,
+                        "metadata": metadata,
+                        "distance": 1 - float(score),
+                        "relevance_score": float(score)
+                    })
+                    if len(formatted) == n_results:
+                        break
+                results.append(formatted)
+        
+        return results
     
     def delete_document(self, doc_id: str) -> bool:
         """Delete all chunks for a document"""
         try:
-            # Get all IDs for this document
-            results = self.collection.get(
-                where={"doc_id": doc_id}
-            )
-            
-            if results["ids"]:
-                self.collection.delete(ids=results["ids"])
+            with self._lock:
+                ids = self.doc_map.pop(doc_id, [])
+                
+                for id_ in ids:
+                    del self.payloads[id_]
+                
+                if ids and self._supports_remove():
+                    self.index.remove_ids(np.array(ids, dtype=np.int64))
+                elif ids and self.index is not None:
+                    # HNSW graphs can't drop nodes: skip them at search time
+                    # until enough pile up to rebuild
+                    self.tombstones.update(ids)
+                    self._exclude = None
+                    self._maybe_rebuild()
+                if ids and self.pending is not None:
+                    keep = ~np.isin(self.pending_ids, ids)
+                    self.pending, self.pending_ids = self.pending[keep], self.pending_ids[keep]
+                
+                if ids:
+                    self._persist()
             
             return True
         except Exception:
@@ -116,18 +487,12 @@ class VectorStore:
     
     def get_document_count(self) -> int:
         """Get total number of chunks in the store"""
-        return self.collection.count()
+        return len(self.payloads)
     
     def get_all_documents(self) -> List[str]:
         """Get unique document IDs"""
-        results = self.collection.get(include=["metadatas"])
-        
-        doc_ids = set()
-        for metadata in results.get("metadatas", []):
-            if metadata and "doc_id" in metadata:
-                doc_ids.add(metadata["doc_id"])
-        
-        return list(doc_ids)
+        with self._lock:
+            return list(self.doc_map)
 
 
 # Singleton instance
@@ -0,0 +1,60 @@
+"""
+Export the embedding model to ONNX for the onnxruntime backend
+
+Usage (from the backend directory):
+    python scripts/export_onnx.py [--quantize]
+
+Then set EMBEDDING_BACKEND=onnx (and EMBEDDING_DTYPE=int8 to use the
+quantized model).
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from tokenizers import Tokenizer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quantize", action="store_true", help="Also write an INT8 dynamically quantized model")
+    parser.add_argument("--max-length", type=int, default=256, help="Tokenizer truncation length")
+    args = parser.parse_args()
+
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    model_id = settings.embedding_model
+    if "/" not in model_id:
+        model_id = f"sentence-transformers/{model_id}"
+
+    out_dir = settings.onnx_model_dir
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"📦 Exporting {model_id} to {out_dir}")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+    model.save_pretrained(out_dir)
+    AutoTokenizer.from_pretrained(model_id).save_pretrained(out_dir)
+
+    # Bake truncation into tokenizer.json so the runtime needs no extra config
+    tokenizer_file = out_dir / "tokenizer.json"
+    tokenizer = Tokenizer.from_file(str(tokenizer_file))
+    tokenizer.enable_truncation(max_length=args.max_length)
+    tokenizer.save(str(tokenizer_file))
+
+    if args.quantize:
+        print("🔧 Writing INT8 quantized model")
+        quantizer = ORTQuantizer.from_pretrained(out_dir)
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=out_dir, quantization_config=qconfig)
+
+    print("✅ Done!")
+
+
+if __name__ == "__main__":
+    main()
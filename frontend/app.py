@@ -4,7 +4,7 @@ A simple AI-powered document search application.
 """
 
 import streamlit as st
-import requests
+import httpx
 import os
 
 # Configuration
@@ -64,6 +64,13 @@ st.markdown("""
 
 
 
+@st.cache_resource
+def get_client():
+    """HTTP client shared across reruns, so connections to the backend are reused"""
+    return httpx.Client(base_url=API_URL, timeout=30)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
 def check_api_health():
     """Check if backend is running with retry logic"""
     import time
@@ -71,7 +78,7 @@ def check_api_health():
     # Try multiple times (backend might be starting up)
     for attempt in range(3):
         try:
-            resp = requests.get(f"{API_URL}/health", timeout=5)
+            resp = get_client().get("/health", timeout=5)
             if resp.status_code == 200:
                 return True, resp.json()
         except:
@@ -88,7 +95,7 @@ def upload_document(file):
     """Upload a document"""
     try:
         files = {"file": (file.name, file.getvalue(), file.type)}
-        resp = requests.post(f"{API_URL}/documents/upload", files=files, timeout=300)
+        resp = get_client().post("/documents/upload", files=files, timeout=300)
         return resp.json()
     except Exception as e:
         return {"error": str(e)}
@@ -97,20 +104,20 @@ def upload_document(file):
 def search_documents(query, top_k=5):
     """Search documents"""
     try:
-        resp = requests.post(
-            f"{API_URL}/search",
-            json={"query": query, "top_k": top_k},
-            timeout=30
+        resp = get_client().post(
+            "/search",
+            json={"query": query, "top_k": top_k}
         )
         return resp.json()
     except Exception as e:
         return {"error": str(e)}
 
 
+@st.cache_data(ttl=10, show_spinner=False)
 def get_documents():
     """Get list of documents"""
     try:
-        resp = requests.get(f"{API_URL}/documents", timeout=10)
+        resp = get_client().get("/documents", timeout=10)
         return resp.json() if resp.status_code == 200 else []
     except:
         return []
@@ -119,12 +126,18 @@ def get_documents():
 def delete_document(doc_id):
     """Delete a document"""
     try:
-        resp = requests.delete(f"{API_URL}/documents/{doc_id}", timeout=10)
+        resp = get_client().delete(f"/documents/{doc_id}", timeout=10)
         return resp.status_code == 200
     except:
         return False
 
 
+def refresh_documents():
+    """Drop cached document list and chunk count after a change"""
+    get_documents.clear()
+    check_api_health.clear()
+
+
 def main():
     # Header
     st.markdown("""
@@ -138,6 +151,8 @@ def main():
     is_healthy, health_info = check_api_health()
     
     if not is_healthy:
+        # Don't remember the failure, so the next rerun checks again
+        check_api_health.clear()
         st.error("""
         ⚠️ **Backend is not running!**
         
@@ -164,6 +179,7 @@ def main():
                 st.error(f"❌ {result['error']}")
             else:
                 st.success(f"✅ Uploaded! ({result.get('chunk_count', 0)} chunks)")
+                refresh_documents()
                 st.rerun()
         
         st.markdown("---")
@@ -183,6 +199,7 @@ def main():
                 with col2:
                     if st.button("🗑️", key=f"del_{doc['id']}"):
                         delete_document(doc['id'])
+                        refresh_documents()
                         st.rerun()
         
         st.markdown("---")
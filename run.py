@@ -9,6 +9,8 @@ import os
 import time
 from pathlib import Path
 
+import httpx
+
 
 def kill_process_on_port(port: int):
     """Kill any process using the specified port (Windows)"""
@@ -44,6 +46,24 @@ def kill_process_on_port(port: int):
     return False
 
 
+def wait_for_backend(process: subprocess.Popen, url: str, timeout: float = 60) -> bool:
+    """Poll the health endpoint until the backend answers or the timeout passes"""
+    deadline = time.monotonic() + timeout
+    
+    while time.monotonic() < deadline:
+        # Backend crashed on startup
+        if process.poll() is not None:
+            return False
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    
+    return False
+
+
 def main():
     root_dir = Path(__file__).parent.absolute()
     backend_dir = root_dir / "backend"
@@ -73,7 +93,8 @@ def main():
         creationflags=subprocess.CREATE_NEW_CONSOLE if sys.platform == "win32" else 0
     )
     
-    time.sleep(8)  # Wait longer for embedding model to load
+    if not wait_for_backend(backend_process, "http://127.0.0.1:8000/health"):
+        print("⚠️  Backend is not responding yet, starting frontend anyway")
     
     # Start frontend
     print("🖥️  Starting Frontend on http://localhost:8501")